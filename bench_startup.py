@@ -0,0 +1,76 @@
+"""
+Cold-start benchmark: time to get the bot ready to serve, against state size.
+
+    python bench_startup.py [voters ...]
+
+For every size a PicklePersistence file is generated. The application from main.py is
+then built over it, and Application.initialize() (which loads the whole persistence file)
+and post_init are timed. Only the getMe round trip is skipped, so the numbers cover
+local startup work and not Telegram latency. Time to the first update depends on
+Telegram, so the bot reports it in its startup log instead.
+"""
+import asyncio
+import os
+import pickle
+import sys
+import tempfile
+import time
+import warnings
+
+from bench_tally import make_votes
+
+started = time.perf_counter()
+import main
+from telegram import User
+from telegram.ext import ApplicationBuilder, ExtBot
+from telegram.warnings import PTBUserWarning
+import_elapsed = time.perf_counter() - started
+
+# Предупреждения per_message у ConversationHandler к замеру не относятся
+warnings.filterwarnings("ignore", category=PTBUserWarning)
+
+class OfflineBot(ExtBot):
+    """Bot that answers getMe locally, so initialize() does no network I/O."""
+
+    async def get_me(self, *args, **kwargs) -> User:
+        self._bot_user = User(id=1, is_bot=True, first_name="bench", username="bench_bot")
+        return self._bot_user
+
+def make_state(num_voters: int, num_topics: int = 200, max_votes: int = 4) -> dict:
+    topics, votes = make_votes(num_voters, num_topics, max_votes)
+    return {
+        "bot_data": {"topics": topics, "votes": votes, "num_rooms": 3, "num_slots": 4, "max_votes": max_votes},
+        # user_data и chat_data бот больше не сохраняет
+        "user_data": {},
+        "chat_data": {},
+        "callback_data": None,
+        "conversations": {},
+    }
+
+async def measure(path: str) -> tuple:
+    started = time.perf_counter()
+    app = main.build_application(ApplicationBuilder().bot(OfflineBot("0:bench")), path)
+    built = time.perf_counter()
+    await app.initialize()
+    initialized = time.perf_counter()
+    await app.post_init(app)
+    ready = time.perf_counter()
+    await app.shutdown()
+    return built - started, initialized - built, ready - initialized, ready - started
+
+def main_bench() -> None:
+    sizes = [int(arg) for arg in sys.argv[1:]] or [0, 1_000, 10_000, 50_000]
+    print(f"import main: {import_elapsed * 1000:.1f} ms (STARTUP_MODE={main.STARTUP_MODE})")
+    print(f"{'voters':>7} {'file':>9} {'build':>9} {'initialize':>11} {'post_init':>10} {'ready':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_voters in sizes:
+            path = os.path.join(tmp, f"bot_data_{num_voters}.pkl")
+            with open(path, "wb") as file:
+                pickle.dump(make_state(num_voters), file)
+            size_kb = os.path.getsize(path) / 1024
+            build, initialize, post_init, ready = asyncio.run(measure(path))
+            print(f"{num_voters:>7} {size_kb:>6.0f} KB {build * 1000:>6.1f} ms {initialize * 1000:>8.1f} ms "
+                  f"{post_init * 1000:>7.1f} ms {ready * 1000:>6.1f} ms")
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,64 @@
+"""
+Benchmark of the tally engine against the old Counter loop from /finalize.
+
+    python bench_tally.py [voters] [topics] [max_votes]
+"""
+import random
+import sys
+import time
+from collections import Counter
+
+from tally import TALLY_METHODS, VoteTally
+
+def make_votes(num_voters: int, num_topics: int, max_votes: int) -> tuple:
+    rng = random.Random(42)
+    categories = ("Поделиться", "Создать", "Обсудить", "Объединиться")
+    topics = [f"Спикер {i}: {categories[i % len(categories)]}. Тема {i}" for i in range(num_topics)]
+    votes = {
+        str(100000 + user): rng.sample(topics, rng.randint(1, max_votes))
+        for user in range(num_voters)
+    }
+    return topics, votes
+
+def counter_loop(topics: list, votes: dict) -> list:
+    all_votes = []
+    for user_votes in votes.values():
+        all_votes.extend(user_votes)
+    vote_count = Counter(all_votes)
+    for topic in topics:
+        vote_count.setdefault(topic, 0)
+    voted_topics = [(t, c) for t, c in vote_count.items() if c > 0]
+    return sorted(voted_topics, key=lambda x: (-x[1], str(x[0]).lower()))
+
+def best_of(func, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main() -> None:
+    num_voters = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    num_topics = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    max_votes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    topics, votes = make_votes(num_voters, num_topics, max_votes)
+    print(f"{num_voters} voters × {num_topics} topics, up to {max_votes} votes each")
+
+    print(f"{'Counter loop (approval)':<32}{best_of(lambda: counter_loop(topics, votes)) * 1000:8.2f} ms")
+    for method in TALLY_METHODS:
+        elapsed = best_of(lambda: VoteTally(topics, votes).ranking(method))
+        print(f"{'build + ' + method:<32}{elapsed * 1000:8.2f} ms")
+
+    def all_methods() -> None:
+        vote_tally = VoteTally(topics, votes)
+        for method in TALLY_METHODS:
+            vote_tally.ranking(method)
+    print(f"{'build + all methods':<32}{best_of(all_methods) * 1000:8.2f} ms")
+
+    expected = [t for t, _ in counter_loop(topics, votes)]
+    vote_tally = VoteTally(topics, votes)
+    assert [vote_tally.topics[col] for col in vote_tally.ranking("approval")[0]] == expected
+
+if __name__ == "__main__":
+    main()
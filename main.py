@@ -1,15 +1,27 @@
+from startup import StartupTimeline
+
+# Засекаем время до тяжёлых импортов telegram, чтобы видеть полную картину холодного старта
+timeline = StartupTimeline()
+
 import os
+import asyncio
+import functools
 import logging
-from collections import Counter
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler,
-    ConversationHandler, MessageHandler, filters, PicklePersistence
+    Application, ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler,
+    ConversationHandler, MessageHandler, TypeHandler, filters, PicklePersistence, PersistenceInput
 )
 from telegram.error import BadRequest
 
+from render_cache import RenderCache
+from tally import (
+    TALLY_METHODS, DEFAULT_TALLY_METHOD, VoteTally, build_schedule, format_score, personal_schedule
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 load_dotenv()
@@ -17,16 +29,25 @@ TOKEN = os.getenv('TOKEN')
 TOPICS_CHAT = os.getenv('TOPICS_CHAT')
 VOTING_CHAT = os.getenv('VOTING_CHAT')
 PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'bot_data.pkl')
-print("TOKEN:", TOKEN, "TOPICS_CHAT:", TOPICS_CHAT, "VOTING_CHAT:", VOTING_CHAT)
-if not TOKEN or not TOPICS_CHAT or not VOTING_CHAT:
-    logger.error("Ошибка: не все переменные окружения установлены.")
-    exit(1)
+# lazy: кэши отчётов прогреваются в фоне после старта, eager: до приёма первого обновления
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'lazy')
+TIMEZONE_NAME = os.getenv('TIMEZONE', 'Europe/Moscow')
+DATETIME_FORMAT = "%d.%m.%Y %H:%M"
+# Колбэки, меняющие голос; после закрытия голосования отклоняются до построения клавиатуры
+VOTE_CALLBACKS = ("submit_votes", "changevote")
 
-persistence = PicklePersistence(filepath=PERSISTENCE_PATH)
+render_cache = RenderCache(maxsize=64)
+timeline.mark("импорт")
 
 ROOM_SELECTION, SLOT_SELECTION, NAME_ROOM_SELECTION, NAME_SLOT_SELECTION, NAME_INPUT = range(5)
 ADD_NAME, ADD_CATEGORY, ADD_TOPIC = range(5, 8)
 
+def check_config() -> None:
+    logger.info("TOPICS_CHAT: %s, VOTING_CHAT: %s, TOKEN задан: %s", TOPICS_CHAT, VOTING_CHAT, bool(TOKEN))
+    if not TOKEN or not TOPICS_CHAT or not VOTING_CHAT:
+        logger.error("Ошибка: не все переменные окружения установлены.")
+        exit(1)
+
 def normalize_booked_slots(bot_data: dict) -> dict:
     """
     Store booked slots as {room: {slot_number: custom_name}} for easier processing.
@@ -39,6 +60,117 @@ def normalize_booked_slots(bot_data: dict) -> dict:
     bot_data['booked_slots'] = booked_slots
     return booked_slots
 
+def read_booked_slots(bot_data: dict) -> dict:
+    """Normalized booked slots for read-only reports; unlike normalize_booked_slots, bot_data is left untouched."""
+    return {
+        room: {slot_num: "Забронировано" for slot_num in slots} if isinstance(slots, list) else slots
+        for room, slots in bot_data.get('booked_slots', {}).items()
+    }
+
+def bump_state_version(bot_data: dict, *kinds: str) -> None:
+    """Mark topics, votes, bookings or settings as changed so that cached reports are rendered again."""
+    versions = bot_data.setdefault('state_versions', {})
+    for kind in kinds:
+        versions[kind] = versions.get(kind, 0) + 1
+
+def state_version(bot_data: dict, *kinds: str) -> tuple:
+    versions = bot_data.get('state_versions', {})
+    return tuple(versions.get(kind, 0) for kind in kinds)
+
+# Части состояния, от которых зависит текст каждого отчёта
+REPORT_DEPENDENCIES = {
+    'admin': ('settings', 'votes', 'bookings'),
+    'finalize': ('topics', 'votes', 'bookings', 'settings'),
+    'stats': ('topics', 'votes'),
+    'topiclist': ('topics',),
+}
+
+def report_key(report: str, bot_data: dict, *args) -> tuple:
+    return (report,) + args + state_version(bot_data, *REPORT_DEPENDENCIES[report])
+
+def state_snapshot(bot_data: dict) -> dict:
+    """
+    Copy of the containers that handlers change in place, so that reports can be rendered
+    from a worker thread while the event loop keeps mutating bot_data.
+    """
+    snapshot = dict(bot_data)
+    snapshot['topics'] = list(bot_data.get('topics', []))
+    snapshot['votes'] = dict(bot_data.get('votes', {}))
+    snapshot['booked_slots'] = {room: slots.copy() for room, slots in bot_data.get('booked_slots', {}).items()}
+    snapshot['state_versions'] = dict(bot_data.get('state_versions', {}))
+    return snapshot
+
+def resolve_tally_method(context: ContextTypes.DEFAULT_TYPE) -> str | None:
+    """
+    Tally method from the command argument (/finalize borda) or the event setting.
+    Return None for an unknown argument so that the handler can list the valid methods.
+    """
+    if context.args:
+        method = context.args[0].lower()
+        return method if method in TALLY_METHODS else None
+    return context.bot_data.get('tally_method', DEFAULT_TALLY_METHOD)
+
+def tally_methods_text() -> str:
+    return "\n".join(f"{key} — {title}" for key, title in TALLY_METHODS.items())
+
+@functools.cache
+def voting_timezone():
+    # zoneinfo нужен только для окон голосования, поэтому не импортируем его при старте
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(TIMEZONE_NAME)
+
+def format_datetime(moment: datetime) -> str:
+    return moment.astimezone(voting_timezone()).strftime(DATETIME_FORMAT)
+
+def voting_closed_reason(bot_data: dict) -> str | None:
+    """Return why voting is closed right now, or None while it is open."""
+    if 'final_snapshot' in bot_data:
+        return "Голосование завершено."
+    window = bot_data.get('voting_window')
+    if not window:
+        return None
+    now = datetime.now(timezone.utc)
+    if now < window['opens']:
+        return f"Голосование откроется {format_datetime(window['opens'])}."
+    if now >= window['closes']:
+        return "Голосование завершено."
+    return None
+
+def voting_deadline_passed(bot_data: dict) -> bool:
+    if 'final_snapshot' in bot_data:
+        return True
+    window = bot_data.get('voting_window')
+    return bool(window) and datetime.now(timezone.utc) >= window['closes']
+
+def final_snapshot(bot_data: dict) -> dict:
+    """
+    Compute the final schedule once after the deadline and keep it in bot_data,
+    so every later /finalize serves the same result even after a restart.
+    """
+    if 'final_snapshot' not in bot_data:
+        method = bot_data.get('tally_method', DEFAULT_TALLY_METHOD)
+        message, final_schedule = cached_finalize(bot_data, method)
+        bot_data['final_schedule'] = final_schedule
+        # Индекс для /myschedule хранится и в снимке, чтобы его не потеряли очистки после дедлайна
+        bot_data['final_snapshot'] = {'message': message, 'method': method, 'final_schedule': final_schedule}
+    return bot_data['final_snapshot']
+
+def published_schedule(bot_data: dict) -> dict | None:
+    """Schedule that /myschedule answers from: the frozen snapshot after the deadline, else the last /finalize."""
+    snapshot = bot_data.get('final_snapshot')
+    if snapshot and 'final_schedule' in snapshot:
+        return snapshot['final_schedule']
+    return bot_data.get('final_schedule')
+
+def vote_selection(user_data: dict, bot_data: dict, user_id: int) -> list:
+    """
+    Current keyboard selection of the user. user_data is not persisted, so after a restart
+    the selection starts again from the submitted votes instead of from an empty list.
+    """
+    if "vote_selection" not in user_data:
+        user_data["vote_selection"] = bot_data.get("votes", {}).get(str(user_id), []).copy()
+    return user_data["vote_selection"]
+
 def reset_vote_state(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Remove cached vote selections from all users to avoid stale limits."""
     for data in context.application.user_data.values():
@@ -47,7 +179,7 @@ def reset_vote_state(context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     bot = context.bot
-    bot_username = (await bot.get_me()).username
+    bot_username = bot.username
     chat = update.effective_chat
     message_thread_id = update.effective_message.message_thread_id if update.effective_message else None
 
@@ -110,50 +242,58 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             message_thread_id=message_thread_id
         )
 
-async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    message_thread_id = update.effective_message.message_thread_id if update.effective_message else None
-    bot_data = context.bot_data
+def render_admin(bot_data: dict) -> str:
     num_rooms = bot_data.get('num_rooms', 3)
     num_slots = bot_data.get('num_slots', 4)
     max_votes = bot_data.get('max_votes', 4)
     room_names = bot_data.get('room_names', [])
     votes = bot_data.get("votes", {})
     num_voters = len(votes)
-    booked_slots = normalize_booked_slots(bot_data)
+    booked_slots = read_booked_slots(bot_data)
 
     admin_message = (
         "<b>Команды для организаторов:</b>\n\n"
         "<b>Общие команды</b>\n"
         "/start - Отправить кнопку \"Перейти к голосованию\"\n"
         "/vote - Голосовать за темы\n"
-        "/changevote - Изменить голос\n\n"
+        "/changevote - Изменить голос\n"
+        "/myschedule - Где в расписании ваши темы\n\n"
         "<b>Установка параметров</b>\n"
         "/setrooms - Установить количество залов\n"
         "/setslots - Установить количество слотов в залах\n"
         "/setvotes - Установить количество доступных голосов\n"
-        "/namerooms - Установить названия залов\n\n"
+        "/setmethod - Выбрать метод подсчёта голосов\n"
+        "/namerooms - Установить названия залов\n"
+        "/setwindow - Задать время открытия и закрытия голосования (/setwindow off - снять)\n\n"
         "<b>Бронирование слотов</b>\n"
         "/bookslot - Забронировать слот в зале\n"
         "/nameslot - Назвать забронированный слот в зале\n\n"
         "<b>Очистка данных</b>\n"
-        "/clearvotes - Очистить голоса\n"
-        "/cleartopics - Очистить все сохранённые темы\n"
+        "/clearvotes - Очистить голоса (снимает зафиксированное расписание и прошедшее окно голосования)\n"
+        "/cleartopics - Очистить все сохранённые темы (снимает зафиксированное расписание и прошедшее окно голосования)\n"
         "/clearbookings - Очистить все бронирования\n\n"
         "<b>Работа с темами</b>\n"
         "/addtopic - Добавить новые темы\n"
         "/removetopic - Удалить темы\n"
         "/topiclist - Показать список тем для голосования\n\n"
         "<b>Составление расписания</b>\n"
-        "/finalize - Завершить голосование и показать результаты\n"
+        "/finalize - Завершить голосование и показать результаты (можно указать метод: /finalize borda)\n"
         "/countvotes - Показать количество участников, проголосовавших за темы\n"
         "/stats - Показать статистику голосов по темам\n"
-        "/secret - Показать подробную статистику голосования\n\n"
+        "/secret - Показать подробную статистику голосования\n"
+        "/cachestats - Показать статистику кэша отчётов\n\n"
         "<b>Текущие настройки:</b>\n"
         f"Количество залов: {num_rooms}\n"
         f"Количество слотов в зале: {num_slots}\n"
         f"Максимальное количество голосов: {max_votes}\n"
+        f"Метод подсчёта: {TALLY_METHODS[bot_data.get('tally_method', DEFAULT_TALLY_METHOD)]}\n"
         f"Число проголосовавших: {num_voters}\n"
     )
+    window = bot_data.get('voting_window')
+    if window:
+        admin_message += (
+            f"Голосование: с {format_datetime(window['opens'])} до {format_datetime(window['closes'])}\n"
+        )
     if room_names:
         admin_message += f"Названия залов: {', '.join(room_names)}\n"
     if booked_slots:
@@ -164,45 +304,46 @@ async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             booked_info += f"<b>{room}:</b> {slot_descriptions}\n"
         admin_message += booked_info
-    await update.message.reply_text(text=admin_message, parse_mode='HTML', message_thread_id=message_thread_id)
+    return admin_message
 
-async def finalize_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def cached_admin(bot_data: dict) -> str:
+    key = report_key('admin', bot_data)
+    return render_cache.get_or_render(key, lambda: render_admin(bot_data))
+
+async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message_thread_id = update.effective_message.message_thread_id if update.effective_message else None
     bot_data = context.bot_data
+    admin_message = cached_admin(bot_data)
+    await update.message.reply_text(text=admin_message, parse_mode='HTML', message_thread_id=message_thread_id)
+
+def render_finalize(bot_data: dict, method: str) -> tuple:
+    """Return the schedule message and the snapshot used by /myschedule."""
     num_rooms = bot_data.get('num_rooms', 3)
     num_slots = bot_data.get('num_slots', 4)
     topics = bot_data.get('topics', [])
     room_names = bot_data.get('room_names', [f"Зал {i+1}" for i in range(num_rooms)])
-    booked_slots = normalize_booked_slots(bot_data)
-    all_votes = []
-    for votes in bot_data.get("votes", {}).values():
-        all_votes.extend(votes)
-    vote_count = Counter(all_votes)
-    for topic in topics:
-        vote_count.setdefault(topic, 0)
-    voted_topics = [(t, c) for t, c in vote_count.items() if c > 0]
-    zero_topics = [(t, c) for t, c in vote_count.items() if c == 0]
-    prioritized_topics = sorted(voted_topics, key=lambda x: (-x[1], str(x[0]).lower()))
-    zero_sorted = sorted(zero_topics, key=lambda x: str(x[0]).lower())
-    schedule = {room: [] for room in room_names}
-    topic_index = 0
-    # Заполняем зал за залом, а не слот за слотом, чтобы темы шли подряд по залам
-    for room in room_names:
-        room_bookings = booked_slots.get(room, {})
-        for slot in range(1, num_slots + 1):
-            if slot in room_bookings:
-                schedule[room].append(room_bookings[slot] or "Забронировано")
-                continue
-            if topic_index < len(prioritized_topics):
-                schedule[room].append(prioritized_topics[topic_index][0])
-                topic_index += 1
-            else:
-                schedule[room].append("Пусто")
+    booked_slots = read_booked_slots(bot_data)
+    vote_tally = VoteTally(topics, bot_data.get("votes", {}))
+    approval = vote_tally.approval()
+    scores = vote_tally.scores(method)
+    schedule, schedule_index, unscheduled_topics = build_schedule(vote_tally, method, room_names, num_slots, booked_slots)
+    # Снимок расписания и индекс тема -> (зал, слот) строятся один раз и обслуживают /myschedule
+    final_schedule = {
+        'room_order': {room: i for i, room in enumerate(room_names)},
+        'schedule': schedule,
+        'index': schedule_index,
+    }
     def format_topic(name: str) -> str:
-        count = vote_count.get(name)
-        return f"{name} ({count} голосов)" if count is not None else name
+        col = vote_tally.index.get(name)
+        if col is None:
+            return name
+        if method in ("approval", "category"):
+            return f"{name} ({approval[col]} голосов)"
+        return f"{name} ({approval[col]} голосов, {format_score(method, scores[col])} баллов)"
 
     schedule_text = "<b>Расписание:</b>\n"
+    if method != DEFAULT_TALLY_METHOD:
+        schedule_text += f"Метод подсчёта: {TALLY_METHODS[method]}\n"
     for room, slots in schedule.items():
         schedule_text += f"\n{room}:\n"
         room_bookings = booked_slots.get(room, {})
@@ -213,15 +354,44 @@ async def finalize_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             else:
                 schedule_text += f"Слот {i}: {format_topic(s)}\n"
 
-    unscheduled_topics = prioritized_topics[topic_index:] + zero_sorted
     if unscheduled_topics:
         unscheduled_text = "\n\n<b>Темы вне расписания:</b>\n"
-        for topic, count in unscheduled_topics:
-            unscheduled_text += f"• {topic} ({count} голосов)\n"
+        for topic in unscheduled_topics:
+            unscheduled_text += f"• {format_topic(topic)}\n"
     else:
         unscheduled_text = "\n\nНет тем вне расписания."
 
-    final_message = f"{schedule_text}{unscheduled_text}"
+    return f"{schedule_text}{unscheduled_text}", final_schedule
+
+def cached_finalize(bot_data: dict, method: str) -> tuple:
+    key = report_key('finalize', bot_data, method)
+    return render_cache.get_or_render(key, lambda: render_finalize(bot_data, method))
+
+async def finalize_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message_thread_id = update.effective_message.message_thread_id if update.effective_message else None
+    bot_data = context.bot_data
+    if voting_deadline_passed(bot_data):
+        snapshot = final_snapshot(bot_data)
+        final_message = snapshot['message']
+        if context.args:
+            await update.message.reply_text(
+                f"Голосование закрыто, показано зафиксированное расписание "
+                f"(метод: {TALLY_METHODS[snapshot['method']]}). Другие методы доступны в /stats <метод>.",
+                message_thread_id=message_thread_id
+            )
+    else:
+        method = resolve_tally_method(context)
+        if method is None:
+            await update.message.reply_text(
+                f"Неизвестный метод подсчёта. Доступные методы:\n{tally_methods_text()}",
+                message_thread_id=message_thread_id
+            )
+            return
+        final_message, final_schedule = cached_finalize(bot_data, method)
+        # Для /myschedule публикуем только расписание по методу события, а не просмотр вроде /finalize borda
+        is_event_method = method == bot_data.get('tally_method', DEFAULT_TALLY_METHOD)
+        if is_event_method and bot_data.get('final_schedule') is not final_schedule:
+            bot_data['final_schedule'] = final_schedule
     await update.message.reply_text(final_message, parse_mode='HTML', message_thread_id=message_thread_id)
 
 async def name_rooms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -239,10 +409,16 @@ async def receive_room_names(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Нет названий. Повторите ввод.")
         return
     context.bot_data['room_names'] = room_names
+    bump_state_version(context.bot_data, 'settings')
     await update.message.reply_text(f"Названия залов: {', '.join(room_names)}")
     user_data.pop('awaiting_room_names')
 
 async def vote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    closed_reason = voting_closed_reason(context.bot_data)
+    if closed_reason:
+        await update.message.reply_text(closed_reason)
+        return
+
     user_id = update.effective_user.id
     command = update.message.text.strip().lower()
 
@@ -286,7 +462,36 @@ async def vote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data["vote_selection"] = context.bot_data["votes"].get(str(user_id), []).copy()
     await send_vote_message(user_id, context)
 
+def my_schedule_text(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> str:
+    final_schedule = published_schedule(context.bot_data)
+    if not final_schedule:
+        return "Расписание ещё не сформировано."
+    user_topics = context.bot_data.get("votes", {}).get(str(user_id))
+    if not user_topics:
+        return "Вы не голосовали. Используйте /vote для голосования."
+    placed, clashes, missing = personal_schedule(final_schedule['room_order'], final_schedule['index'], user_topics)
+    text = ""
+    if placed:
+        text += "Ваши темы в расписании:\n"
+        text += "".join(f"Слот {slot}, {room}: {topic}\n" for slot, room, topic in placed)
+    else:
+        text += "Ни одна из выбранных вами тем не вошла в расписание.\n"
+    if clashes:
+        text += "\nПересечения:\n"
+        text += "".join(f"Слот {slot}: {'; '.join(topics)}\n" for slot, topics in clashes.items())
+    if missing:
+        text += "\nНе вошли в расписание:\n"
+        text += "".join(f"• {topic}\n" for topic in missing)
+    return text
+
+async def my_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(my_schedule_text(update.effective_user.id, context))
+
 async def send_vote_message(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
+    closed_reason = voting_closed_reason(context.bot_data)
+    if closed_reason:
+        await context.bot.send_message(chat_id=user_id, text=closed_reason)
+        return
     selected = context.user_data.get("vote_selection", [])
     topics = context.bot_data.get("topics", [])
     if not topics:
@@ -306,27 +511,36 @@ async def send_vote_message(user_id: int, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    data = query.data
+    if data in VOTE_CALLBACKS or data.isdigit():
+        closed_reason = voting_closed_reason(context.bot_data)
+        if closed_reason:
+            await query.answer(closed_reason, show_alert=True)
+            return
     await query.answer()
     user_id = update.effective_user.id
-    data = query.data
     user_data = context.user_data
     bot_data = context.bot_data
 
     if data == "submit_votes":
-        selected = user_data.get("vote_selection", [])
+        selected = vote_selection(user_data, bot_data, user_id)
         if not selected:
             await query.answer("Нет выбранных тем.", show_alert=True)
             return
         bot_data["votes"][str(user_id)] = selected.copy()
+        bump_state_version(bot_data, 'votes')
         selected_text = "\n".join(f"• {t}" for t in selected)
         reply_markup = InlineKeyboardMarkup([
             [InlineKeyboardButton("Переголосовать", callback_data="changevote")],
+            [InlineKeyboardButton("Моё расписание", callback_data="myschedule")],
             [InlineKeyboardButton("Вернуться в чат", url=VOTING_CHAT)]
         ])
         await query.edit_message_text(f"Спасибо! Вы проголосовали за:\n{selected_text}", reply_markup=reply_markup)
     elif data == "changevote":
         user_data["vote_selection"] = bot_data["votes"].get(str(user_id), []).copy()
         await send_vote_message(user_id, context)
+    elif data == "myschedule":
+        await context.bot.send_message(chat_id=user_id, text=my_schedule_text(user_id, context))
     elif data.startswith("rem_"):
         idx = int(data[4:])
         topics = bot_data.get("topics", [])
@@ -355,6 +569,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             topics = bot_data.get("topics", [])
             new_topics = [t for t in topics if t not in user_data['remove_selection']]
             bot_data["topics"] = new_topics
+            bump_state_version(bot_data, 'topics')
             await query.edit_message_text("Темы удалены.")
             user_data.pop('remove_selection')
     elif data == "cancel_remove":
@@ -367,8 +582,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             return
         topic = topics[idx]
         max_votes = bot_data.get('max_votes', 4)
-        if "vote_selection" not in user_data:
-            user_data["vote_selection"] = []
+        vote_selection(user_data, bot_data, user_id)
         if topic in user_data["vote_selection"]:
             user_data["vote_selection"].remove(topic)
         else:
@@ -414,6 +628,7 @@ async def set_rooms_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         num = int(update.message.text)
         context.bot_data['num_rooms'] = num
+        bump_state_version(context.bot_data, 'settings')
         await update.message.reply_text(f"Количество залов: {num}")
     except:
         await update.message.reply_text("Ошибка ввода. Введите число.")
@@ -431,6 +646,7 @@ async def set_slots_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         num = int(update.message.text)
         context.bot_data['num_slots'] = num
+        bump_state_version(context.bot_data, 'settings')
         await update.message.reply_text(f"Слотов в залах: {num}")
     except:
         await update.message.reply_text("Ошибка ввода. Введите число.")
@@ -448,12 +664,119 @@ async def set_votes_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         num = int(update.message.text)
         context.bot_data['max_votes'] = num
+        bump_state_version(context.bot_data, 'settings')
         await update.message.reply_text(f"Лимит голосов: {num}")
     except:
         await update.message.reply_text("Ошибка ввода. Введите число.")
     finally:
         user_data.pop('awaiting_votes', None)
 
+async def set_method(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.args or context.args[0].lower() not in TALLY_METHODS:
+        await update.message.reply_text(f"Использование: /setmethod <метод>\n{tally_methods_text()}")
+        return
+    method = context.args[0].lower()
+    context.bot_data['tally_method'] = method
+    bump_state_version(context.bot_data, 'settings')
+    await update.message.reply_text(f"Метод подсчёта: {TALLY_METHODS[method]}")
+
+def schedule_voting_close(app: Application) -> None:
+    """(Re)create the job that finalizes the vote at the deadline of the current window."""
+    if app.job_queue is None:
+        logger.warning("JobQueue недоступна: расписание будет зафиксировано при первом /finalize после дедлайна.")
+        return
+    for job in app.job_queue.get_jobs_by_name('close_voting'):
+        job.schedule_removal()
+    window = app.bot_data.get('voting_window')
+    if not window or 'final_snapshot' in app.bot_data:
+        return
+    # Дедлайн, прошедший пока бот был выключен, обрабатываем сразу
+    delay = max((window['closes'] - datetime.now(timezone.utc)).total_seconds(), 0)
+    # Без misfire_grace_time задача, поставленная до запуска планировщика, может быть пропущена
+    app.job_queue.run_once(
+        close_voting, when=delay, name='close_voting', job_kwargs={'misfire_grace_time': None}
+    )
+
+def reset_finalized_event(context: ContextTypes.DEFAULT_TYPE) -> str:
+    """
+    Drop the frozen schedule when votes or topics are cleared for a new event.
+    A window that has already closed goes too; a window that has not closed yet is kept
+    together with its close job. Return a note for the admin's reply.
+    """
+    bot_data = context.bot_data
+    bot_data.pop('final_snapshot', None)
+    window = bot_data.get('voting_window')
+    note = ""
+    if window and datetime.now(timezone.utc) >= window['closes']:
+        bot_data.pop('voting_window')
+        note = " Прошедшее окно голосования снято, голосование открыто."
+    elif window:
+        note = f" Окно голосования сохранено: с {format_datetime(window['opens'])} до {format_datetime(window['closes'])}."
+    bump_state_version(bot_data, 'settings')
+    schedule_voting_close(context.application)
+    return note
+
+def reset_voting_window(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop the voting window, the frozen schedule and the close job, so that a new event starts open."""
+    context.bot_data.pop('voting_window', None)
+    context.bot_data.pop('final_snapshot', None)
+    bump_state_version(context.bot_data, 'settings')
+    schedule_voting_close(context.application)
+
+async def close_voting(context: ContextTypes.DEFAULT_TYPE) -> None:
+    bot_data = context.bot_data
+    snapshot = final_snapshot(bot_data)
+    window = bot_data.get('voting_window') or {}
+    logger.info("Голосование закрыто, расписание зафиксировано (%s)", snapshot['method'])
+    if window.get('chat_id'):
+        await context.bot.send_message(
+            chat_id=window['chat_id'],
+            text=snapshot['message'],
+            parse_mode='HTML',
+            message_thread_id=window.get('thread_id')
+        )
+
+async def set_window(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    bot_data = context.bot_data
+    usage = (
+        "Использование: /setwindow <ДД.ММ.ГГГГ ЧЧ:ММ> <ДД.ММ.ГГГГ ЧЧ:ММ> — открытие и закрытие голосования\n"
+        "/setwindow off — убрать ограничения по времени"
+    )
+    args = context.args or []
+    if args == ['off']:
+        reset_voting_window(context)
+        await update.message.reply_text("Ограничения по времени сняты.")
+        return
+    if len(args) != 4:
+        await update.message.reply_text(usage)
+        return
+    try:
+        opens, closes = (
+            datetime.strptime(f"{day} {clock}", DATETIME_FORMAT).replace(tzinfo=voting_timezone()).astimezone(timezone.utc)
+            for day, clock in (args[:2], args[2:])
+        )
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+    if closes <= opens:
+        await update.message.reply_text("Время закрытия должно быть позже времени открытия.")
+        return
+    bot_data['voting_window'] = {
+        'opens': opens,
+        'closes': closes,
+        'chat_id': update.effective_chat.id,
+        'thread_id': update.effective_message.message_thread_id if update.effective_message else None,
+    }
+    # Новое окно голосования начинает событие заново, старое расписание и его снимок больше не действуют
+    bot_data.pop('final_snapshot', None)
+    bot_data.pop('final_schedule', None)
+    bump_state_version(bot_data, 'settings')
+    schedule_voting_close(context.application)
+    await update.message.reply_text(
+        f"Голосование: с {format_datetime(opens)} до {format_datetime(closes)}. "
+        "Расписание будет опубликовано здесь после закрытия."
+    )
+
 async def add_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_data = context.user_data
     user_data.clear()
@@ -478,6 +801,7 @@ async def done_adding_topics(update: Update, context: ContextTypes.DEFAULT_TYPE)
         new_topics = user_data.pop('new_topics')
         current_topics = context.bot_data.get('topics', [])
         context.bot_data['topics'] = current_topics + new_topics
+        bump_state_version(context.bot_data, 'topics')
         await update.message.reply_text(f"Добавлено тем: {len(new_topics)}")
         user_data.pop('adding_topics')
 
@@ -492,43 +816,90 @@ async def remove_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def clear_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.bot_data['votes'] = {}
+    context.bot_data.pop('final_schedule', None)
+    bump_state_version(context.bot_data, 'votes')
     reset_vote_state(context)
-    await update.message.reply_text("Все голоса очищены.")
+    note = reset_finalized_event(context)
+    await update.message.reply_text(f"Все голоса очищены.{note}")
 
 async def clear_topics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.bot_data['topics'] = []
+    context.bot_data.pop('final_schedule', None)
+    bump_state_version(context.bot_data, 'topics')
     reset_vote_state(context)
-    await update.message.reply_text("Все темы удалены.")
+    note = reset_finalized_event(context)
+    await update.message.reply_text(f"Все темы удалены.{note}")
 
 async def clear_bookings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.bot_data['booked_slots'] = {}
+    context.bot_data.pop('final_schedule', None)
+    bump_state_version(context.bot_data, 'bookings')
     await update.message.reply_text("Бронирования очищены.")
 
 async def count_votes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     num = len(context.bot_data.get("votes", {}))
     await update.message.reply_text(f"Проголосовало: {num} человек")
 
+def render_stats(bot_data: dict, method: str) -> str:
+    topics = bot_data.get("topics", [])
+    votes = bot_data.get("votes", {})
+    if not topics and not votes:
+        return "Нет данных для статистики."
+    vote_tally = VoteTally(topics, votes)
+    approval = vote_tally.approval()
+    scores = vote_tally.scores(method)
+    voted_cols, zero_cols = vote_tally.ranking(method)
+    stats_lines = []
+    if method != DEFAULT_TALLY_METHOD:
+        stats_lines.append(f"Метод подсчёта: {TALLY_METHODS[method]}")
+    for idx, col in enumerate(voted_cols + zero_cols, 1):
+        line = f"{idx}. {vote_tally.topics[col]} — {approval[col]} голосов"
+        if method in ("weighted", "borda"):
+            line += f", {format_score(method, scores[col])} баллов"
+        stats_lines.append(line)
+    if method == "category":
+        stats_lines.append("")
+        stats_lines.append("Голоса по категориям:")
+        for category, total in vote_tally.category_totals().items():
+            stats_lines.append(f"{category} — {total} голосов")
+    return "\n".join(stats_lines)
+
+def cached_stats(bot_data: dict, method: str) -> str:
+    key = report_key('stats', bot_data, method)
+    return render_cache.get_or_render(key, lambda: render_stats(bot_data, method))
+
 async def topic_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message_thread_id = update.effective_message.message_thread_id if update.effective_message else None
-    topics = context.bot_data.get("topics", [])
-    votes = context.bot_data.get("votes", {})
-    if not topics and not votes:
-        await update.message.reply_text("Нет данных для статистики.", message_thread_id=message_thread_id)
+    bot_data = context.bot_data
+    method = resolve_tally_method(context)
+    if method is None:
+        await update.message.reply_text(
+            f"Неизвестный метод подсчёта. Доступные методы:\n{tally_methods_text()}",
+            message_thread_id=message_thread_id
+        )
         return
-    counts = Counter()
-    for user_topics in votes.values():
-        counts.update(user_topics)
-    all_topics = set(topics) | set(counts.keys())
-    sorted_topics = sorted(all_topics, key=lambda t: (-counts.get(t, 0), t.lower()))
-    stats_lines = [f"{idx}. {topic} — {counts.get(topic, 0)} голосов" for idx, topic in enumerate(sorted_topics, 1)]
-    await update.message.reply_text("\n".join(stats_lines), message_thread_id=message_thread_id)
+    text = cached_stats(bot_data, method)
+    await update.message.reply_text(text, message_thread_id=message_thread_id)
 
-async def topic_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    topics = context.bot_data.get("topics", [])
+def render_topic_list(bot_data: dict) -> str:
+    topics = bot_data.get("topics", [])
     if topics:
-        await update.message.reply_text("\n".join(f"{i+1}. {t}" for i, t in enumerate(topics)))
-    else:
-        await update.message.reply_text("Темы отсутствуют.")
+        return "\n".join(f"{i+1}. {t}" for i, t in enumerate(topics))
+    return "Темы отсутствуют."
+
+def cached_topic_list(bot_data: dict) -> str:
+    key = report_key('topiclist', bot_data)
+    return render_cache.get_or_render(key, lambda: render_topic_list(bot_data))
+
+async def topic_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(cached_topic_list(context.bot_data))
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    stats = render_cache.stats()
+    await update.message.reply_text(
+        f"Кэш отчётов: {stats['hits']} попаданий, {stats['misses']} промахов "
+        f"({stats['hit_rate']:.0%}), записей {stats['size']}/{stats['maxsize']}"
+    )
 
 async def secret(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     votes = context.bot_data.get("votes", {})
@@ -576,6 +947,7 @@ async def book_slot_slot_selection(update: Update, context: ContextTypes.DEFAULT
     if selected_slot not in room_bookings:
         room_bookings[selected_slot] = "Забронировано"
         context.bot_data['booked_slots'] = booked_slots
+        bump_state_version(context.bot_data, 'bookings')
         await query.edit_message_text(f"Слот {selected_slot} в {room} забронирован.")
     else:
         await query.edit_message_text(f"Слот {selected_slot} уже занят.")
@@ -645,6 +1017,7 @@ async def set_slot_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return ConversationHandler.END
     room_bookings[slot] = new_name
     context.bot_data['booked_slots'] = booked_slots
+    bump_state_version(context.bot_data, 'bookings')
     await update.message.reply_text(f"Слот {slot} в {room} теперь называется: {new_name}")
     context.user_data.pop('naming_room', None)
     context.user_data.pop('naming_slot', None)
@@ -684,8 +1057,9 @@ async def receive_topic_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
     category = context.user_data.get('category', 'Не определено')
     topic = f"{name}: {category}. {update.message.text.strip()}"
     context.bot_data["topics"] = context.bot_data.get("topics", []) + [topic]
+    bump_state_version(context.bot_data, 'topics')
     
-    bot_username = (await context.bot.get_me()).username
+    bot_username = context.bot.username
     vote_url = f"https://t.me/{bot_username}?start=vote"
     add_topic_url = f"https://t.me/{bot_username}?start=addtopicuser"
     
@@ -705,8 +1079,53 @@ async def cancel_add_topic(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await update.message.reply_text("Добавление отменено.", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
-def main() -> None:
-    app = ApplicationBuilder().token(TOKEN).persistence(persistence).build()
+async def warm_caches(bot_data: dict) -> None:
+    """
+    Render the reports once so that the first /admin, /stats and /finalize are cache hits.
+    Rendering runs in a worker thread over a snapshot. It still holds the GIL, so updates
+    that arrive meanwhile are slowed down, but they no longer wait for a whole render.
+    """
+    snapshot = state_snapshot(bot_data)
+    method = snapshot.get('tally_method', DEFAULT_TALLY_METHOD)
+    for key, render in (
+        (report_key('topiclist', snapshot), lambda: render_topic_list(snapshot)),
+        (report_key('admin', snapshot), lambda: render_admin(snapshot)),
+        (report_key('stats', snapshot, method), lambda: render_stats(snapshot, method)),
+        (report_key('finalize', snapshot, method), lambda: render_finalize(snapshot, method)),
+    ):
+        if key not in render_cache:
+            render_cache.put(key, await asyncio.to_thread(render))
+    timeline.mark("кэши прогреты")
+    logger.info("Старт: %s", timeline.report())
+
+async def post_init(app: Application) -> None:
+    timeline.mark("данные загружены")
+    if isinstance(app.persistence, PicklePersistence):
+        # Старые файлы ещё содержат user_data и chat_data: не переписываем их, файл уменьшится при следующей записи
+        app.persistence.user_data = {}
+        app.persistence.chat_data = {}
+    schedule_voting_close(app)
+    if STARTUP_MODE == 'eager':
+        await warm_caches(app.bot_data)
+
+async def mark_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Обработчик стоит в группе после основных, поэтому отметка ставится, когда ответ уже отправлен
+    if timeline.mark("первое обновление обработано"):
+        logger.info("Старт: %s", timeline.report())
+        # Прогрев начинается только когда приложение уже работает и не задерживает старт
+        if STARTUP_MODE != 'eager':
+            context.application.create_task(warm_caches(context.bot_data))
+
+def build_application(builder: ApplicationBuilder, persistence_path: str) -> Application:
+    # Сохраняем только bot_data: chat_data не используется, а user_data держит лишь выбор на клавиатуре
+    # и флаги диалогов, которые восстанавливаются из bot_data['votes'] или начинаются заново.
+    # Так файл, читаемый целиком в initialize(), растёт только с числом голосов
+    persistence = PicklePersistence(
+        filepath=persistence_path,
+        store_data=PersistenceInput(user_data=False, chat_data=False, callback_data=False)
+    )
+    app = builder.persistence(persistence).post_init(post_init).build()
+    app.add_handler(TypeHandler(Update, mark_first_update), group=1)
 
     conv_handlers = [
         ConversationHandler(
@@ -748,6 +1167,7 @@ def main() -> None:
     app.add_handler(CommandHandler('vote', vote))
     app.add_handler(CommandHandler('changevote', vote))
     app.add_handler(CommandHandler('finalize', finalize_votes))
+    app.add_handler(CommandHandler('myschedule', my_schedule))
     app.add_handler(CommandHandler('addtopic', add_topic))
     app.add_handler(CommandHandler('done', done_adding_topics))
     app.add_handler(CommandHandler('removetopic', remove_topic))
@@ -755,17 +1175,25 @@ def main() -> None:
     app.add_handler(CommandHandler('setrooms', set_rooms))
     app.add_handler(CommandHandler('setslots', set_slots))
     app.add_handler(CommandHandler('setvotes', set_votes))
+    app.add_handler(CommandHandler('setmethod', set_method))
+    app.add_handler(CommandHandler('setwindow', set_window))
     app.add_handler(CommandHandler('clearvotes', clear_votes))
     app.add_handler(CommandHandler('stats', topic_stats))
     app.add_handler(CommandHandler('cleartopics', clear_topics))
     app.add_handler(CommandHandler('countvotes', count_votes))
     app.add_handler(CommandHandler('topiclist', topic_list))
     app.add_handler(CommandHandler('secret', secret))
+    app.add_handler(CommandHandler('cachestats', cache_stats))
 
     app.add_handler(CallbackQueryHandler(button))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_message))
     app.add_error_handler(lambda u,c: logger.error("Ошибка: %s", c.error))
+    return app
 
+def main() -> None:
+    check_config()
+    app = build_application(ApplicationBuilder().token(TOKEN), PERSISTENCE_PATH)
+    timeline.mark("приложение собрано")
     app.run_polling()
 
 if __name__ == '__main__':
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered report messages.
+
+    Keys include the state versions the report depends on, so a bumped version
+    simply produces a new key and stale entries age out through LRU eviction.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._entries
+
+    def get_or_render(self, key: tuple, render):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        value = render()
+        self.put(key, value)
+        return value
+
+    def put(self, key: tuple, value) -> None:
+        """Store a value rendered elsewhere (e.g. by warm-up) without counting a hit or miss."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,20 @@
+import time
+
+class StartupTimeline:
+    """
+    Seconds elapsed since the timeline was created (first thing main.py does)
+    for each startup milestone; later marks with the same name are ignored.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, name: str) -> bool:
+        if name in self.marks:
+            return False
+        self.marks[name] = time.perf_counter() - self.started
+        return True
+
+    def report(self) -> str:
+        return ", ".join(f"{name}: {elapsed * 1000:.0f} мс" for name, elapsed in self.marks.items())
@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain, islice
+from operator import itemgetter
+
+# Категории, которые пользователь выбирает при добавлении темы через диалог
+CATEGORIES = ("Поделиться", "Создать", "Обсудить", "Объединиться")
+NO_CATEGORY = "Без категории"
+
+TALLY_METHODS = {
+    "approval": "Одобрение (число голосов)",
+    "weighted": "Взвешенный по порядку выбора",
+    "borda": "Борда",
+    "category": "По категориям",
+}
+DEFAULT_TALLY_METHOD = "approval"
+
+def topic_category(topic: str) -> str:
+    """
+    Extract the category from a topic in the "[Имя]: [Категория]. [Название]" format.
+    Topics added by organizers via /addtopic have no such prefix and fall into NO_CATEGORY.
+    """
+    _, sep, rest = str(topic).partition(": ")
+    if not sep:
+        return NO_CATEGORY
+    category = rest.split(".", 1)[0].strip()
+    return category if category in CATEGORIES else NO_CATEGORY
+
+class VoteTally:
+    """
+    Vote counts built from bot_data["votes"] for every tally method.
+
+    Approval is one Counter over all ballots, computed in __init__; its keys together with
+    the topic list fix the column set, so every score list has one entry per topic,
+    including removed topics that still have votes. Rank-aware methods use one Counter
+    per position in the selection order, built lazily on first use.
+    """
+
+    def __init__(self, topics: list, votes: dict):
+        self.ballots = list(votes.values())
+        self.width = max(map(len, self.ballots), default=0)
+        self._approval_counts = Counter(chain.from_iterable(self.ballots))
+        # Голоса за удалённые темы тоже учитываются, как и раньше в Counter
+        self.topics = list(dict.fromkeys(chain(topics, self._approval_counts)))
+        self.index = {t: i for i, t in enumerate(self.topics)}
+        self._scores = {}
+        self._rank_counts = None
+
+    def rank_counts(self) -> list:
+        """rank_counts()[k][topic] is the number of voters who chose the topic (k+1)-th."""
+        if self._rank_counts is None:
+            ballots = sorted(self.ballots, key=len, reverse=True)
+            negative_sizes = [-len(ballot) for ballot in ballots]
+            self._rank_counts = []
+            for rank in range(self.width):
+                # Бюллетени отсортированы по длине, поэтому выбравшие больше rank тем образуют префикс
+                depth = bisect_left(negative_sizes, -rank)
+                self._rank_counts.append(Counter(map(itemgetter(rank), islice(ballots, depth))))
+        return self._rank_counts
+
+    def _rank_weighted(self, weights: list, zero) -> list:
+        scores = {}
+        for weight, counts in zip(weights, self.rank_counts()):
+            for topic, count in counts.items():
+                scores[topic] = scores.get(topic, zero) + weight * count
+        return [scores.get(topic, zero) for topic in self.topics]
+
+    def approval(self) -> list:
+        if "approval" not in self._scores:
+            counts = self._approval_counts
+            self._scores["approval"] = [counts.get(topic, 0) for topic in self.topics]
+        return self._scores["approval"]
+
+    def weighted(self) -> list:
+        """Rank-weighted score: the k-th chosen topic of a ballot gets 1/k."""
+        if "weighted" not in self._scores:
+            self._scores["weighted"] = self._rank_weighted([1 / (rank + 1) for rank in range(self.width)], 0.0)
+        return self._scores["weighted"]
+
+    def borda(self) -> list:
+        """Borda count over the longest ballot: the k-th chosen topic gets width - k + 1 points."""
+        if "borda" not in self._scores:
+            self._scores["borda"] = self._rank_weighted([self.width - rank for rank in range(self.width)], 0)
+        return self._scores["borda"]
+
+    def categories(self) -> list:
+        return [topic_category(t) for t in self.topics]
+
+    def category_totals(self) -> dict:
+        """Total approval votes per category, in CATEGORIES order."""
+        totals = {c: 0 for c in CATEGORIES + (NO_CATEGORY,)}
+        for category, count in zip(self.categories(), self.approval()):
+            totals[category] += count
+        return totals
+
+    def scores(self, method: str) -> list:
+        if method in ("approval", "category"):
+            return self.approval()
+        if method == "weighted":
+            return self.weighted()
+        if method == "borda":
+            return self.borda()
+        raise ValueError(f"Unknown tally method: {method}")
+
+    def ranking(self, method: str) -> tuple:
+        """
+        Return (prioritized, zero) lists of topic indices.
+        Prioritized topics have at least one vote and are ordered for scheduling by the
+        chosen method, ties broken by lowercased name; zero-vote topics are sorted by name.
+        """
+        scores = self.scores(method)
+        approval = self.approval()
+        topics = self.topics
+        voted = [col for col in range(len(topics)) if approval[col] > 0]
+        zero = sorted((col for col in range(len(topics)) if approval[col] == 0),
+                      key=lambda col: str(topics[col]).lower())
+        voted.sort(key=lambda col: (-scores[col], str(topics[col]).lower()))
+        if method == "category":
+            # Чередуем категории, чтобы в расписание попали лидеры каждой из них
+            categories = self.categories()
+            groups = {c: [] for c in CATEGORIES + (NO_CATEGORY,)}
+            for col in voted:
+                groups[categories[col]].append(col)
+            queues = [g for g in groups.values() if g]
+            voted = []
+            depth = max((len(g) for g in queues), default=0)
+            for i in range(depth):
+                voted.extend(g[i] for g in queues if i < len(g))
+        return voted, zero
+
+def format_score(method: str, score) -> str:
+    if method == "weighted":
+        return f"{score:.2f}"
+    return str(score)
+
+def build_schedule(tally: VoteTally, method: str, room_names: list, num_slots: int, booked_slots: dict) -> tuple:
+    """
+    Fill the rooms with topics in ranking order and return (schedule, index, unscheduled).
+    schedule maps room -> list of slot contents, index maps each scheduled topic to its
+    (room, slot) and unscheduled lists the remaining topics, voted ones first.
+    """
+    voted_cols, zero_cols = tally.ranking(method)
+    prioritized_topics = [tally.topics[col] for col in voted_cols]
+    schedule = {room: [] for room in room_names}
+    index = {}
+    topic_index = 0
+    # Заполняем зал за залом, а не слот за слотом, чтобы темы шли подряд по залам
+    for room in room_names:
+        room_bookings = booked_slots.get(room, {})
+        for slot in range(1, num_slots + 1):
+            if slot in room_bookings:
+                schedule[room].append(room_bookings[slot] or "Забронировано")
+                continue
+            if topic_index < len(prioritized_topics):
+                topic = prioritized_topics[topic_index]
+                schedule[room].append(topic)
+                index[topic] = (room, slot)
+                topic_index += 1
+            else:
+                schedule[room].append("Пусто")
+    unscheduled = prioritized_topics[topic_index:] + [tally.topics[col] for col in zero_cols]
+    return schedule, index, unscheduled
+
+def personal_schedule(room_order: dict, index: dict, user_topics: list) -> tuple:
+    """
+    Look up a voter's topics in a finalized schedule index in O(len(user_topics)).
+    Return (placed, clashes, missing): placed is a list of (slot, room, topic) sorted by
+    slot and room order, clashes maps a slot to the user's topics sharing it.
+    """
+    placed = []
+    missing = []
+    by_slot = {}
+    for topic in user_topics:
+        place = index.get(topic)
+        if place is None:
+            missing.append(topic)
+            continue
+        room, slot = place
+        placed.append((slot, room, topic))
+        by_slot.setdefault(slot, []).append(topic)
+    placed.sort(key=lambda item: (item[0], room_order.get(item[1], len(room_order))))
+    clashes = {slot: topics for slot, topics in sorted(by_slot.items()) if len(topics) > 1}
+    return placed, clashes, missing